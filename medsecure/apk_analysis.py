@@ -1,23 +1,114 @@
 # apk_analysis.py
+import struct
+import zipfile
+
 from apkutils2 import APK
 
-def analyze_apk(apk_path: str):
+from tracker_analysis import classify_domains, scan_zip_for_domains
+
+# binary AXML chunk types (only the ones the lite parser needs)
+_RES_STRING_POOL_TYPE = 0x0001
+_RES_XML_START_ELEMENT_TYPE = 0x0102
+_UTF8_FLAG = 0x00000100
+
+
+def _axml_string_pool(data, chunk_start, header_size):
+    """Decode the AXML string pool into a list of Python strings."""
+    string_count, _style_count, flags, strings_start = struct.unpack_from(
+        "<IIII", data, chunk_start + 8
+    )
+    offsets = struct.unpack_from(
+        "<%dI" % string_count, data, chunk_start + header_size
+    )
+    is_utf8 = bool(flags & _UTF8_FLAG)
+    base = chunk_start + strings_start
+    strings = []
+    for off in offsets:
+        pos = base + off
+        if is_utf8:
+            # utf8 pool: u8 char-count then u8 byte-count (high bit extends)
+            if data[pos] & 0x80:
+                pos += 2
+            else:
+                pos += 1
+            byte_len = data[pos]
+            if byte_len & 0x80:
+                byte_len = ((byte_len & 0x7F) << 8) | data[pos + 1]
+                pos += 2
+            else:
+                pos += 1
+            strings.append(data[pos:pos + byte_len].decode("utf-8", errors="ignore"))
+        else:
+            char_len = struct.unpack_from("<H", data, pos)[0]
+            pos += 2
+            if char_len & 0x8000:
+                char_len = ((char_len & 0x7FFF) << 16) | struct.unpack_from("<H", data, pos)[0]
+                pos += 2
+            strings.append(
+                data[pos:pos + 2 * char_len].decode("utf-16-le", errors="ignore")
+            )
+    return strings
+
+
+def _parse_manifest_lite(data):
     """
-    Returns a dictionary with basic APK info:
-    - package name
-    - permissions
+    Lite binary-manifest parse: walk the AXML chunk stream and resolve only
+    the strings needed for `package` on <manifest> and `android:name` on
+    <uses-permission>, skipping the full tree/resource decode.
+    Returns (package_name, permissions) or raises on malformed input.
     """
-    apk = APK(apk_path)
-    manifest = apk.get_manifest()
+    strings = []
+    package_name = None
+    permissions = []
+
+    pos = 8  # skip the RES_XML file header
+    end = min(len(data), struct.unpack_from("<I", data, 4)[0])
+    while pos + 8 <= end:
+        chunk_type, header_size, chunk_size = struct.unpack_from("<HHI", data, pos)
+        if chunk_size < 8:
+            break
+        if chunk_type == _RES_STRING_POOL_TYPE:
+            strings = _axml_string_pool(data, pos, header_size)
+        elif chunk_type == _RES_XML_START_ELEMENT_TYPE:
+            body = pos + header_size
+            _ns, name_idx, attr_start, attr_size, attr_count = struct.unpack_from(
+                "<IIHHH", data, body
+            )
+            tag = strings[name_idx] if 0 <= name_idx < len(strings) else ""
+            if tag in ("manifest", "uses-permission"):
+                wanted = "package" if tag == "manifest" else "name"
+                attr_pos = body + attr_start
+                for _ in range(attr_count):
+                    _ans, aname_idx, raw_idx, _tsize, _res0, dtype, tdata = struct.unpack_from(
+                        "<IIIHBBI", data, attr_pos
+                    )
+                    attr_pos += attr_size
+                    aname = strings[aname_idx] if 0 <= aname_idx < len(strings) else ""
+                    if aname != wanted:
+                        continue
+                    if raw_idx != 0xFFFFFFFF and raw_idx < len(strings):
+                        value = strings[raw_idx]
+                    elif dtype == 0x03 and tdata < len(strings):  # TYPE_STRING
+                        value = strings[tdata]
+                    else:
+                        continue
+                    if tag == "manifest":
+                        package_name = value
+                    else:
+                        permissions.append(value)
+                    break
+        pos += chunk_size
 
-    pkg = manifest.get('@package')
+    if package_name is None and not permissions:
+        raise ValueError("no manifest data found in AXML stream")
+    return package_name, permissions
 
+
+def _permissions_from_manifest(manifest):
     # extract permissions robustly
     permissions = []
 
-    # Case 1: top-level 'uses-permission'
-    if 'uses-permission' in manifest:
-        data = manifest['uses-permission']
+    def collect(data):
         if isinstance(data, dict):
             name = data.get('@android:name')
             if name:
@@ -28,29 +119,81 @@ def analyze_apk(apk_path: str):
                 if name:
                     permissions.append(name)
 
+    # Case 1: top-level 'uses-permission'
+    if 'uses-permission' in manifest:
+        collect(manifest['uses-permission'])
+
     # Case 2: nested under 'manifest' tag
     if 'manifest' in manifest and isinstance(manifest['manifest'], dict):
         inner = manifest['manifest']
         if 'uses-permission' in inner:
-            data = inner['uses-permission']
-            if isinstance(data, dict):
-                name = data.get('@android:name')
-                if name:
-                    permissions.append(name)
-            elif isinstance(data, list):
-                for item in data:
-                    name = item.get('@android:name')
-                    if name:
-                        permissions.append(name)
+            collect(inner['uses-permission'])
 
     # remove duplicates + sort
-    permissions = sorted(set(permissions))
+    return sorted(set(permissions))
+
 
+def _info_from_manifest(manifest):
     return {
-        "package_name": pkg,
-        "permissions": permissions
+        "package_name": manifest.get('@package'),
+        "permissions": _permissions_from_manifest(manifest),
     }
 
+
+def _manifest_from_bytes(manifest_bytes):
+    """Parse binary AndroidManifest.xml bytes into the same nested-dict
+    shape apkutils2 produces, without re-opening the APK."""
+    from apkutils2.axml.axmlparser import AXML
+    import xmltodict
+    return xmltodict.parse(AXML(manifest_bytes).get_xml())
+
+
+def analyze_apk(apk_path: str):
+    """
+    Returns a dictionary with basic APK info:
+    - package name
+    - permissions
+    """
+    apk = APK(apk_path)
+    manifest = apk.get_manifest()
+    return _info_from_manifest(manifest)
+
+
+def analyze_apk_full(apk_path: str):
+    """
+    Single-pass analysis: one ZipFile handle serves both the manifest parse
+    and the tracker domain scan, so the zip central directory is read once.
+    Returns (info, tracker_summary).
+    """
+    with zipfile.ZipFile(apk_path, "r") as zf:
+        info = None
+        try:
+            manifest_bytes = zf.read("AndroidManifest.xml")
+        except Exception:
+            manifest_bytes = None
+        if manifest_bytes:
+            # lite parse first (no apkutils2 on the hot path), then the
+            # apkutils2 AXML decode of the same bytes
+            try:
+                package_name, permissions = _parse_manifest_lite(manifest_bytes)
+                info = {
+                    "package_name": package_name,
+                    "permissions": sorted(set(permissions)),
+                }
+            except Exception:
+                try:
+                    manifest = _manifest_from_bytes(manifest_bytes)
+                    info = _info_from_manifest(manifest)
+                except Exception:
+                    pass
+        tracker_summary = classify_domains(scan_zip_for_domains(zf))
+
+    if info is None:
+        # lite parse failed; fall back to the full apkutils2 path
+        info = analyze_apk(apk_path)
+    return info, tracker_summary
+
+
 if __name__ == "__main__":
     info = analyze_apk("F-Droid.apk")  # make sure sample.apk exists in this folder
     print("Package:", info["package_name"])
@@ -1,14 +1,17 @@
 # app.py
 import streamlit as st
+import asyncio
+import hashlib
 import tempfile
 import requests
 from bs4 import BeautifulSoup
 import zipfile
 import os
 
-from apk_analysis import analyze_apk
+_UA_HEADERS = {"User-Agent": "Mozilla/5.0"}
+
+from apk_analysis import analyze_apk_full
 from nlp_risk import compute_privacy_risk
-from tracker_analysis import analyze_trackers
 
 # ---------------------------------------------------------
 # PAGE CONFIG
@@ -89,8 +92,8 @@ def extract_apk_from_bundle(bundle_path):
 
             chosen = next((a for a in apks if os.path.basename(a).lower() == "base.apk"), None)
             if not chosen:
-                apks = sorted(apks, key=lambda x: zf.getinfo(x).file_size, reverse=True)
-                chosen = apks[0]
+                # only the largest APK is needed; no point sorting them all
+                chosen = max(apks, key=lambda x: zf.getinfo(x).file_size)
 
             data = zf.read(chosen)
             with tempfile.NamedTemporaryFile(delete=False, suffix=".apk") as f:
@@ -99,12 +102,78 @@ def extract_apk_from_bundle(bundle_path):
     except:
         return None
 
+def _find_policy_link(play_html):
+    soup = BeautifulSoup(play_html, "lxml")
+    link = next((a["href"] for a in soup.find_all("a", href=True)
+                 if "privacy" in (a.text or "").lower()), None)
+    if link and link.startswith("/"):
+        link = "https://play.google.com" + link
+    return link
+
+def _policy_page_text(policy_html):
+    ps = BeautifulSoup(policy_html, "lxml")
+    for t in ps(["script", "style", "noscript"]):
+        t.extract()
+    return " ".join(ps.get_text().split())
+
+async def _fetch_policy_async(package_name):
+    # both fetches share one session; BeautifulSoup parses run in a worker
+    # thread so the event loop isn't blocked by lxml
+    import aiohttp
+
+    play_url = f"https://play.google.com/store/apps/details?id={package_name}"
+    async with aiohttp.ClientSession(headers=_UA_HEADERS) as session:
+        async with session.get(play_url) as r:
+            play_html = await r.text()
+        link = await asyncio.to_thread(_find_policy_link, play_html)
+        if not link:
+            return ""
+        async with session.get(link) as pr:
+            policy_html = await pr.text()
+        return await asyncio.to_thread(_policy_page_text, policy_html)
+
+# no persist="disk": Streamlit's disk storage ignores TTL, which would
+# serve arbitrarily stale policy text forever after a restart
+@st.cache_data(ttl=86400, show_spinner=False)
+def _fetch_privacy_policy_cached(package_name):
+    # raises on fetch/parse errors: st.cache_data does not cache raised
+    # exceptions, so only genuinely fetched results get the 24h cache and
+    # a transient failure is retried on the next rerun
+    try:
+        return asyncio.run(_fetch_policy_async(package_name))
+    except ImportError:
+        pass
+    # aiohttp unavailable: plain blocking fallback
+    play_url = f"https://play.google.com/store/apps/details?id={package_name}"
+    r = requests.get(play_url, headers=_UA_HEADERS)
+    link = _find_policy_link(r.text)
+    if not link:
+        return ""
+    pr = requests.get(link, headers=_UA_HEADERS)
+    return _policy_page_text(pr.text)
+
+def fetch_privacy_policy(package_name):
+    try:
+        return _fetch_privacy_policy_cached(package_name)
+    except Exception:
+        return ""
+
 # ---------------------------------------------------------
 # MAIN LOGIC
 # ---------------------------------------------------------
+@st.cache_data(show_spinner=False)
+def run_analysis_pipeline(digest, _apk_path):
+    # keyed on the file digest (leading underscore excludes the temp path,
+    # which changes on every rerun) so theme toggles / tab switches don't
+    # re-run the static analysis
+    return analyze_apk_full(_apk_path)
+
 if uploaded_apk:
+    file_bytes = uploaded_apk.read()
+    digest = hashlib.blake2b(file_bytes).hexdigest()
+
     with tempfile.NamedTemporaryFile(delete=False) as tmp:
-        tmp.write(uploaded_apk.read())
+        tmp.write(file_bytes)
         bundle_path = tmp.name
 
     st.success(f"✅ Uploaded: {uploaded_apk.name}")
@@ -118,8 +187,7 @@ if uploaded_apk:
         st.error("No APK found inside uploaded file.")
         st.stop()
 
-    info = analyze_apk(apk_path)
-    tracker_info = analyze_trackers(apk_path)
+    info, tracker_info = run_analysis_pipeline(digest, apk_path)
 
     # ---------------------------------------------------------
     # DASHBOARD METRICS
@@ -153,32 +221,18 @@ if uploaded_apk:
         else:
             st.success("No known tracker domains detected.")
 
+        with st.expander("View all contacted domains"):
+            # sorted lazily, only when the user expands the list
+            for dom in sorted(tracker_info["all_domains"]):
+                st.write(dom)
+
     with tab3:
         st.subheader("Privacy Policy")
-        policy_text = ""
-        try:
-            play_url = f"https://play.google.com/store/apps/details?id={info['package_name']}"
-            r = requests.get(play_url, headers={"User-Agent": "Mozilla/5.0"})
-            soup = BeautifulSoup(r.text, "lxml")
-
-            link = next((a["href"] for a in soup.find_all("a", href=True)
-                         if "privacy" in (a.text or "").lower()), None)
-
-            if link:
-                if link.startswith("/"):
-                    link = "https://play.google.com" + link
-
-                pr = requests.get(link, headers={"User-Agent": "Mozilla/5.0"})
-                ps = BeautifulSoup(pr.text, "lxml")
-                for t in ps(["script", "style", "noscript"]):
-                    t.extract()
-
-                policy_text = " ".join(ps.get_text().split())
-                st.write(policy_text[:2000] + "...")
-            else:
-                st.warning("Privacy policy not found.")
-        except:
-            st.warning("Unable to fetch privacy policy.")
+        policy_text = fetch_privacy_policy(info["package_name"])
+        if policy_text:
+            st.write(policy_text[:2000] + "...")
+        else:
+            st.warning("Privacy policy not found.")
 
     with tab4:
         st.subheader("AI-Based Privacy Risk")
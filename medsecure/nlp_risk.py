@@ -1,47 +1,238 @@
 # nlp_risk.py
 from typing import List, Dict
+import hashlib
 import logging
+import os
+import re
+import shutil
+import threading
+
+# must be set before torch/OpenMP initialize to get full-core BLAS GEMMs
+os.environ.setdefault("OMP_NUM_THREADS", str(os.cpu_count() or 1))
 
 # small keyword fallback (kept similar to previous)
+_CLAIM_KEYWORDS = {
+    "mentions_location": ["location", "geolocation", "gps", "locational data"],
+    "mentions_contacts": ["contacts", "address book", "contact list"],
+    "mentions_camera": ["camera", "photos", "take pictures", "video recording"],
+    "mentions_microphone": ["microphone", "audio recording", "voice recording"],
+    "mentions_storage": ["storage", "files on your device", "media files", "photos and videos"],
+    "mentions_phone": ["phone number", "call log", "telephony"],
+    "mentions_ads_tracking": ["advertising id", "ads", "ad partners", "personalized ads", "analytics partners"],
+    "mentions_third_parties": ["third parties", "partners", "service providers", "affiliates"],
+    "mentions_security": ["encrypt", "security", "protect your data", "secure", "safeguard"],
+}
+
+# one compiled alternation per claim: a single C-level search per group
+# replaces dozens of `in` passes, and groups stay independent so keywords
+# shared across claims ("partners", "photos") can't shadow each other
+_CLAIM_PATTERNS = {
+    claim: re.compile("|".join(map(re.escape, words)))
+    for claim, words in _CLAIM_KEYWORDS.items()
+}
+
 def _keyword_extract_claims(policy_text: str) -> Dict[str, bool]:
     text = policy_text.lower()
     return {
-        "mentions_location": any(word in text for word in ["location", "geolocation", "gps", "locational data"]),
-        "mentions_contacts": any(word in text for word in ["contacts", "address book", "contact list"]),
-        "mentions_camera": any(word in text for word in ["camera", "photos", "take pictures", "video recording"]),
-        "mentions_microphone": any(word in text for word in ["microphone", "audio recording", "voice recording"]),
-        "mentions_storage": any(word in text for word in ["storage", "files on your device", "media files", "photos and videos"]),
-        "mentions_phone": any(word in text for word in ["phone number", "call log", "telephony"]),
-        "mentions_ads_tracking": any(word in text for word in ["advertising id", "ads", "ad partners", "personalized ads", "analytics partners"]),
-        "mentions_third_parties": any(word in text for word in ["third parties", "partners", "service providers", "affiliates"]),
-        "mentions_security": any(word in text for word in ["encrypt", "security", "protect your data", "secure", "safeguard"]),
+        claim: pattern.search(text) is not None
+        for claim, pattern in _CLAIM_PATTERNS.items()
     }
 
 _ZS_CLASSIFIER = None
 _ZS_MODEL_NAME = "facebook/bart-large-mnli"
+_ZS_ONNX_DIR = os.path.join(
+    os.path.expanduser("~"), ".cache", "appshield", "bart-mnli-onnx-int8"
+)
+
+def _init_zero_shot_onnx():
+    """
+    Build the zero-shot pipeline on ONNX Runtime with dynamic int8
+    quantization. The exported + quantized model is cached on disk so the
+    one-off export cost is only paid on first run.
+    """
+    from transformers import AutoTokenizer, pipeline
+    from optimum.onnxruntime import ORTModelForSequenceClassification, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+
+    if not os.path.isdir(_ZS_ONNX_DIR):
+        # export into a scratch dir and publish it with an atomic rename,
+        # so an interrupted export (e.g. the preload daemon thread dying at
+        # process exit) can't leave a half-written cache dir that passes
+        # the isdir guard and poisons every future init
+        scratch_dir = "%s.tmp-%d" % (_ZS_ONNX_DIR, os.getpid())
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+        model = ORTModelForSequenceClassification.from_pretrained(
+            _ZS_MODEL_NAME, export=True, provider="CPUExecutionProvider"
+        )
+        model.save_pretrained(scratch_dir)
+        quantizer = ORTQuantizer.from_pretrained(scratch_dir)
+        qconfig = AutoQuantizationConfig.avx512_vnni(is_static=False)
+        quantizer.quantize(save_dir=scratch_dir, quantization_config=qconfig)
+        tok = AutoTokenizer.from_pretrained(_ZS_MODEL_NAME)
+        tok.save_pretrained(scratch_dir)
+        # drop the fp32 graph: only the quantized one is served, and two
+        # .onnx files would make from_pretrained ambiguous
+        fp32_graph = os.path.join(scratch_dir, "model.onnx")
+        if os.path.exists(fp32_graph):
+            os.remove(fp32_graph)
+        try:
+            os.replace(scratch_dir, _ZS_ONNX_DIR)
+        except OSError:
+            # another process published the cache first; use theirs
+            shutil.rmtree(scratch_dir, ignore_errors=True)
+            if not os.path.isdir(_ZS_ONNX_DIR):
+                raise
+
+    model = ORTModelForSequenceClassification.from_pretrained(
+        _ZS_ONNX_DIR, file_name="model_quantized.onnx", provider="CPUExecutionProvider"
+    )
+    tok = AutoTokenizer.from_pretrained(_ZS_ONNX_DIR)
+    return pipeline("zero-shot-classification", model=model, tokenizer=tok)
+
+_ZS_INIT_LOCK = threading.Lock()
+
+def _tune_torch_threads():
+    try:
+        import torch
+        torch.set_num_threads(os.cpu_count() or 1)
+    except Exception:
+        pass
 
 def _init_zero_shot():
     global _ZS_CLASSIFIER
     if _ZS_CLASSIFIER is not None:
         return True
-    try:
-        from transformers import pipeline
-        _ZS_CLASSIFIER = pipeline("zero-shot-classification", model=_ZS_MODEL_NAME, device=-1)
-        return True
-    except Exception as e:
-        logging.warning(f"Zero-shot init failed: {e}")
-        _ZS_CLASSIFIER = None
-        return False
+    # serialized so the preload thread and the first request don't both
+    # load the model
+    with _ZS_INIT_LOCK:
+        if _ZS_CLASSIFIER is not None:
+            return True
+        _tune_torch_threads()
+        try:
+            _ZS_CLASSIFIER = _init_zero_shot_onnx()
+            return True
+        except Exception as e:
+            logging.warning(f"ONNX zero-shot init failed, falling back to torch: {e}")
+        try:
+            from transformers import pipeline
+            _ZS_CLASSIFIER = pipeline("zero-shot-classification", model=_ZS_MODEL_NAME, device=-1)
+            return True
+        except Exception as e:
+            logging.warning(f"Zero-shot init failed: {e}")
+            _ZS_CLASSIFIER = None
+            return False
+
+# warm-start: load the model in the background at import so it overlaps
+# with the user's upload and APK scan instead of stalling the first risk
+# request
+threading.Thread(target=_init_zero_shot, daemon=True).start()
+
+# memoize model outputs by text digest: re-analyzing the same app (or two
+# apps pointing at the same policy) should not re-run the classifier
+_CLAIMS_CACHE: Dict[str, Dict[str, bool]] = {}
+_RISK_CACHE: Dict[tuple, Dict] = {}
+_CACHE_MAX_ENTRIES = 64
+
+def _text_digest(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8", errors="ignore")).hexdigest()
+
+def _cache_put(cache, key, value):
+    if len(cache) >= _CACHE_MAX_ENTRIES:
+        cache.pop(next(iter(cache)))
+    cache[key] = value
 
 def extract_policy_claims(policy_text: str) -> Dict[str, bool]:
     """
     Primary: use zero-shot transformer to detect claims.
     Fallback: keyword-based detection when transformer unavailable.
+    Results are memoized by text digest.
     """
     # Short-circuit empty
     if not policy_text or len(policy_text.strip()) < 20:
         return _keyword_extract_claims(policy_text or "")
 
+    digest = _text_digest(policy_text)
+    cached = _CLAIMS_CACHE.get(digest)
+    if cached is not None:
+        return cached
+    claims = _extract_policy_claims_uncached(policy_text)
+    _cache_put(_CLAIMS_CACHE, digest, claims)
+    return claims
+
+# cap on text handed to the transformer; BART attention is O(n^2) inside a
+# 1024-token window and runs once per candidate label, so shorter input
+# pays off ninefold
+_ZS_MAX_CHARS = 2000
+
+def _condense_policy_text(policy_text: str, candidate_labels: List[str]) -> str:
+    """
+    Reduce the policy to the sentences most relevant to the candidate
+    labels (TF-IDF-style hashing similarity when sklearn is available),
+    falling back to a plain prefix truncation at a word boundary.
+    """
+    if len(policy_text) <= _ZS_MAX_CHARS:
+        return policy_text
+    sentences = re.split(r"(?<=[.!?])\s+", policy_text)
+    try:
+        from sklearn.feature_extraction.text import HashingVectorizer
+
+        vec = HashingVectorizer(n_features=1 << 16, alternate_sign=False, norm="l2")
+        sent_matrix = vec.transform(sentences)
+        label_matrix = vec.transform(candidate_labels)
+        # cosine relevance of each sentence to its best-matching label
+        scores = (sent_matrix @ label_matrix.T).max(axis=1).toarray().ravel()
+        ranked = sorted(range(len(sentences)), key=lambda i: scores[i], reverse=True)
+        picked = []
+        total = 0
+        for i in ranked:
+            if scores[i] <= 0:
+                break
+            picked.append(i)
+            total += len(sentences[i]) + 1
+            if total >= _ZS_MAX_CHARS:
+                break
+        if picked:
+            # keep document order so the classifier sees coherent text
+            return " ".join(sentences[i] for i in sorted(picked))[:_ZS_MAX_CHARS]
+    except Exception:
+        pass
+    return policy_text[:_ZS_MAX_CHARS].rsplit(" ", 1)[0]
+
+def _batched_label_scores(classifier, text: str, candidate_labels: List[str]) -> Dict[str, float]:
+    """
+    Score all candidate labels in one forward pass. The zero-shot pipeline
+    runs one NLI pass per label (9 small GEMMs here); tokenizing all
+    premise/hypothesis pairs as a batch turns that into a single batched
+    matmul with the same per-label softmax the pipeline applies in
+    multi-label mode.
+    """
+    import torch
+
+    tokenizer = classifier.tokenizer
+    model = classifier.model
+    hypotheses = [f"This example is {label}." for label in candidate_labels]
+    batch = tokenizer(
+        [text] * len(candidate_labels),
+        hypotheses,
+        padding=True,
+        truncation="only_first",
+        max_length=1024,
+        return_tensors="pt",
+    )
+    with torch.no_grad():
+        logits = model(**batch).logits
+
+    label2id = {k.lower(): v for k, v in model.config.label2id.items()}
+    entail_id = label2id.get("entailment", logits.shape[-1] - 1)
+    contra_id = label2id.get("contradiction", 0)
+    # multi-label scoring: softmax over (contradiction, entailment) per pair
+    pair = torch.softmax(logits[:, [contra_id, entail_id]], dim=-1)
+    scores = pair[:, 1].tolist()
+    return dict(zip(candidate_labels, scores))
+
+
+def _extract_policy_claims_uncached(policy_text: str) -> Dict[str, bool]:
+
     # Attempt zero-shot
     ok = _init_zero_shot()
     if not ok or _ZS_CLASSIFIER is None:
@@ -60,10 +251,16 @@ def extract_policy_claims(policy_text: str) -> Dict[str, bool]:
             "shares data with third parties or partners",
             "mentions security or encryption"
         ]
-        # transformer expects plain text
-        res = classifier(policy_text, candidate_labels, multi_label=True, truncation=True)
-        # res['scores'] align with candidate_labels
-        labels = {lab: score for lab, score in zip(res["labels"], res["scores"])}
+        # transformer expects plain text; condense first so the batched
+        # forward pass runs over a short, relevant input
+        condensed = _condense_policy_text(policy_text, candidate_labels)
+        try:
+            labels = _batched_label_scores(classifier, condensed, candidate_labels)
+        except Exception as e:
+            logging.warning(f"Batched zero-shot scoring failed, using pipeline: {e}")
+            res = classifier(condensed, candidate_labels, multi_label=True, truncation=True)
+            # res['scores'] align with candidate_labels
+            labels = {lab: score for lab, score in zip(res["labels"], res["scores"])}
         # choose thresholds; 0.35 is moderate
         def label_true(s): return labels.get(s, 0.0) >= 0.35
 
@@ -111,16 +308,35 @@ SENSITIVE_PERMISSION_GROUPS = {
     ]
 }
 
+# flattened at import time: permissions are exact Android constants, so a
+# single dict lookup replaces the nested suffix scans
+PERM_SUFFIX_TO_GROUP = {
+    perm: group
+    for group, perms in SENSITIVE_PERMISSION_GROUPS.items()
+    for perm in perms
+}
+
 def group_permissions(permissions: List[str]) -> Dict[str, bool]:
     used_groups = {k: False for k in SENSITIVE_PERMISSION_GROUPS.keys()}
     for perm in permissions:
-        suffix = perm.split(".")[-1]
-        for group, perm_suffixes in SENSITIVE_PERMISSION_GROUPS.items():
-            if any(suffix == p or suffix.endswith(p) for p in perm_suffixes):
-                used_groups[group] = True
+        suffix = perm.rsplit(".", 1)[-1]
+        group = PERM_SUFFIX_TO_GROUP.get(suffix)
+        if group:
+            used_groups[group] = True
     return used_groups
 
 def compute_privacy_risk(permissions: List[str], policy_text: str) -> Dict:
+    # memoized on (permissions, policy digest); the heavy work is the
+    # classifier call inside extract_policy_claims
+    cache_key = (tuple(sorted(permissions)), _text_digest(policy_text or ""))
+    cached = _RISK_CACHE.get(cache_key)
+    if cached is not None:
+        return cached
+    result = _compute_privacy_risk_uncached(permissions, policy_text)
+    _cache_put(_RISK_CACHE, cache_key, result)
+    return result
+
+def _compute_privacy_risk_uncached(permissions: List[str], policy_text: str) -> Dict:
     # same tuned algorithm as before but calls extract_policy_claims()
     if not policy_text or len(policy_text.strip()) < 50:
         return {
@@ -1,13 +1,65 @@
 # tracker_analysis.py
+import io
+import logging
+import mmap
+import struct
+import threading
 import zipfile
 import re
 from urllib.parse import urlparse
 from typing import Dict, Set
 import csv
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 # URL regex (bytes)
 URL_PATTERN = re.compile(rb"https?://[^\s\"'<>]+")
+
+
+def _build_url_finder():
+    """
+    Return a callable buf -> list of matched URL byte strings.
+
+    Preferred: Hyperscan, which compiles the pattern to a vectorized DFA
+    and scans several GB/s. Hyperscan reports a match event per end offset,
+    so only the longest match per start position is kept (mirroring the
+    greedy `re` semantics). Falls back to URL_PATTERN.findall.
+    """
+    try:
+        import hyperscan
+
+        db = hyperscan.Database()
+        db.compile(
+            expressions=[rb"https?://[^\s\"'<>]+"],
+            flags=[hyperscan.HS_FLAG_SOM_LEFTMOST],
+        )
+        # a hyperscan scratch must not be used by two scans at once, and
+        # the thread pool scans entries concurrently — give each thread
+        # its own scratch instead of sharing the database's implicit one
+        scratch_store = threading.local()
+
+        def find(buf):
+            scratch = getattr(scratch_store, "scratch", None)
+            if scratch is None:
+                scratch = hyperscan.Scratch(db)
+                scratch_store.scratch = scratch
+            ends = {}
+
+            def on_match(_pat_id, start, end, _flags, _ctx=None):
+                if end > ends.get(start, 0):
+                    ends[start] = end
+
+            db.scan(buf, match_event_handler=on_match, scratch=scratch)
+            # buffer order, like findall, so callers can treat the last
+            # match as the rightmost one
+            return [bytes(buf[s:e]) for s, e in sorted(ends.items())]
+
+        return find
+    except Exception:
+        return URL_PATTERN.findall
+
+
+_FIND_URLS = _build_url_finder()
 HERE = os.path.dirname(__file__)
 TRACKERS_CSV = os.path.join(HERE, "trackers.csv")
 
@@ -37,6 +89,28 @@ def load_tracker_list():
 TRACKER_PATTERNS = load_tracker_list()
 
 
+# every CSV pattern is a plain domain, so matching is two hashed lookups:
+# the domain itself, then each parent suffix peeled off label by label
+TRACKER_CATEGORY = dict(TRACKER_PATTERNS)
+
+
+def _match_tracker(dom):
+    """Match dom exactly or as a subdomain of a tracker pattern.
+    Returns (pattern, category) or None."""
+    category = TRACKER_CATEGORY.get(dom)
+    if category:
+        return (dom, category)
+    # a.b.tracker.com -> b.tracker.com -> tracker.com ...
+    idx = dom.find(".")
+    while idx != -1:
+        suffix = dom[idx + 1:]
+        category = TRACKER_CATEGORY.get(suffix)
+        if category:
+            return (suffix, category)
+        idx = dom.find(".", idx + 1)
+    return None
+
+
 def _clean_domain(url: str) -> str:
     try:
         parsed = urlparse(url)
@@ -50,61 +124,202 @@ def _clean_domain(url: str) -> str:
         return ""
 
 
-def extract_domains_from_apk(apk_path: str, max_file_size: int = 2_000_000) -> Set[str]:
+def _clean_domain_bytes(raw: bytes) -> str:
+    """
+    Byte-level version of _clean_domain for matched URLs. URL_PATTERN
+    guarantees an https?:// prefix, so the host is simply the slice between
+    "://" and the first of / ? # : — no need for urlparse's full
+    (allocating, pure-Python) split.
+    """
+    start = raw.find(b"://") + 3
+    end = len(raw)
+    for sep in (b"/", b"?", b"#", b":"):
+        i = raw.find(sep, start)
+        if i != -1 and i < end:
+            end = i
+    host = raw[start:end].lower()
+    if host.startswith(b"www."):
+        host = host[4:]
+    try:
+        return host.decode("utf-8", errors="ignore")
+    except Exception:
+        return ""
+
+
+# chunked streaming scan parameters
+_SCAN_CHUNK_SIZE = 1 << 20  # 1 MiB per read
+_SCAN_OVERLAP = 256         # carried over so URLs straddling chunks still match
+_MAX_URL_LEN = 2048         # cap on how much of a boundary-cut URL is carried
+
+# formats that hold no plain https?:// strings worth scanning: native ELF
+# libraries, compiled Android binary XML, and compiled resources (ARSC).
+# dex is deliberately NOT here — it is the main source of URL strings.
+_SKIP_MAGICS = (b"\x7fELF", b"\x03\x00\x08\x00", b"\x02\x00\x0c\x00")
+
+
+def _is_skippable_binary(head: bytes) -> bool:
+    return head[:4] in _SKIP_MAGICS
+
+
+def _scan_entry(zf: zipfile.ZipFile, info: zipfile.ZipInfo, seen_urls: Set[bytes]) -> Set[str]:
+    """Stream one zip entry in chunks and collect domains from URL matches."""
     domains: Set[str] = set()
     try:
-        with zipfile.ZipFile(apk_path, "r") as zf:
-            for info in zf.infolist():
-                if info.is_dir():
-                    continue
-                name = info.filename.lower()
-
-                # skip some heavy binary types
-                if name.endswith((
-                    ".so", ".png", ".jpg", ".jpeg", ".webp",
-                    ".gif", ".mp3", ".mp4", ".ogg", ".wav",
-                    ".ttf", ".otf", ".ico", ".pdf"
-                )):
-                    continue
-
-                # skip huge files (performance)
-                if info.file_size > max_file_size:
-                    continue
-
-                try:
-                    data = zf.read(info)
-                except Exception:
-                    continue
+        with zf.open(info, "r") as fh:
+            br = io.BufferedReader(fh, buffer_size=_SCAN_CHUNK_SIZE)
+            tail = b""
+            first = True
+            at_eof = False
+            while not at_eof:
+                chunk = br.read(_SCAN_CHUNK_SIZE)
+                at_eof = not chunk
+                # extension filters miss renamed/inlined binaries; sniff the
+                # magic bytes before paying for a full scan
+                if first:
+                    first = False
+                    if _is_skippable_binary(chunk):
+                        break
+                buf = tail + chunk
+                if not buf:
+                    break
 
                 # search for urls in raw bytes (works for text and many binary blobs)
-                for match in URL_PATTERN.findall(data):
-                    try:
-                        url = match.decode("utf-8", errors="ignore")
-                    except Exception:
+                matches = _FIND_URLS(buf)
+
+                # a match running to the end of the buffer may be a URL cut
+                # mid-string by the chunk boundary: don't emit its truncated
+                # host, carry it into the tail so the full URL matches on
+                # the next iteration (bounded so a pathological "URL" can't
+                # grow the tail without limit)
+                cut = None
+                if not at_eof and matches and buf.endswith(matches[-1]):
+                    cut = matches.pop()
+
+                for match in matches:
+                    # duplicate guard on the raw bytes skips host extraction
+                    # for repeated URLs (same CDN endpoint thousands of times)
+                    if match in seen_urls:
                         continue
-                    domain = _clean_domain(url)
+                    seen_urls.add(match)
+                    domain = _clean_domain_bytes(match)
                     if domain:
                         domains.add(domain)
 
+                if cut is not None:
+                    tail = buf[-max(_SCAN_OVERLAP, min(len(cut), _MAX_URL_LEN)):]
+                else:
+                    tail = buf[-_SCAN_OVERLAP:]
+    except Exception as e:
+        # corrupt entries are expected in the wild, but a failure here
+        # drops every domain in the entry, so it must at least be visible
+        logging.warning(f"Domain scan failed for {info.filename}: {e}")
+    return domains
+
+
+def _stored_data_span(mm, info: zipfile.ZipInfo):
+    """
+    Return (start, end) of a ZIP_STORED entry's raw data inside the mapped
+    file, by reading the name/extra lengths out of its local file header.
+    """
+    header = mm[info.header_offset:info.header_offset + 30]
+    if len(header) < 30 or header[:4] != b"PK\x03\x04":
+        return None
+    name_len, extra_len = struct.unpack("<HH", header[26:30])
+    start = info.header_offset + 30 + name_len + extra_len
+    return start, start + info.file_size
+
+
+def _scan_stored_entry(mm, info: zipfile.ZipInfo, seen_urls: Set[bytes]) -> Set[str]:
+    """Scan a stored entry in place over the mmap, without any copy."""
+    domains: Set[str] = set()
+    span = _stored_data_span(mm, info)
+    if span is None:
+        return domains
+    start, end = span
+    if _is_skippable_binary(mm[start:start + 4]):
+        return domains
+    for raw in _FIND_URLS(memoryview(mm)[start:end]):
+        if raw in seen_urls:
+            continue
+        seen_urls.add(raw)
+        domain = _clean_domain_bytes(raw)
+        if domain:
+            domains.add(domain)
+    return domains
+
+
+def scan_zip_for_domains(zf: zipfile.ZipFile) -> Set[str]:
+    """Scan all entries of an already-open ZipFile for domains, so callers
+    holding a handle (e.g. the fused analyze pass) reuse the parsed zip
+    index instead of reopening the APK."""
+    domains: Set[str] = set()
+    # raw URL bytes already processed this run; shared across entries so a
+    # URL repeated in many files is only cleaned once
+    seen_urls: Set[bytes] = set()
+    try:
+        stored = []
+        compressed = []
+        for info in zf.infolist():
+            if info.is_dir():
+                continue
+            name = info.filename.lower()
+
+            # skip some heavy binary types
+            if name.endswith((
+                ".so", ".png", ".jpg", ".jpeg", ".webp",
+                ".gif", ".mp3", ".mp4", ".ogg", ".wav",
+                ".ttf", ".otf", ".ico", ".pdf"
+            )):
+                continue
+            if info.compress_type == zipfile.ZIP_STORED:
+                stored.append(info)
+            else:
+                compressed.append(info)
+
+        # stored entries need no inflate: mmap the APK once and run the
+        # regex directly over each entry's byte range (zero-copy, and
+        # pages are shared via the OS page cache)
+        if stored:
+            try:
+                with open(zf.filename, "rb") as f:
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                        for info in stored:
+                            domains.update(_scan_stored_entry(mm, info, seen_urls))
+            except Exception:
+                compressed = stored + compressed
+
+        # decompression (zlib) and regex scanning both release the GIL,
+        # so entries can be scanned in parallel; each worker opens its
+        # own sub-stream on the shared ZipFile.
+        if compressed:
+            max_workers = min(8, os.cpu_count() or 1)
+            with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                for entry_domains in pool.map(lambda i: _scan_entry(zf, i, seen_urls), compressed):
+                    domains.update(entry_domains)
+
     except Exception:
         return set()
 
     return domains
 
 
+def extract_domains_from_apk(apk_path: str) -> Set[str]:
+    try:
+        with zipfile.ZipFile(apk_path, "r") as zf:
+            return scan_zip_for_domains(zf)
+    except Exception:
+        return set()
+
+
 def classify_domains(domains: Set[str]) -> Dict:
     tracker_domains: Dict[str, str] = {}
     category_counts: Dict[str, int] = {}
 
     for dom in domains:
-        matched_category = None
-        for pattern, category in TRACKER_PATTERNS:
-            # match pattern as suffix or substring (covers subdomains)
-            if pattern in dom:
-                matched_category = category
-                break
-
-        if matched_category:
+        # exact + parent-suffix lookups (covers subdomains)
+        hit = _match_tracker(dom)
+        if hit:
+            _pattern, matched_category = hit
             tracker_domains[dom] = matched_category
             category_counts[matched_category] = category_counts.get(matched_category, 0) + 1
 
@@ -121,7 +336,9 @@ def classify_domains(domains: Set[str]) -> Dict:
         risk_level = "HIGH"
 
     return {
-        "all_domains": sorted(domains),
+        # raw set: sorting thousands of strings is display-only work, so
+        # the UI sorts what it actually renders
+        "all_domains": domains,
         "tracker_domains": tracker_domains,
         "num_domains": num_domains,
         "num_trackers": num_trackers,